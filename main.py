@@ -9,33 +9,30 @@ without the rest of the Nansen Legacy logging system
 @author: Luke Marsden
 """
 
-import xlsxwriter
 import requests
-import json
-import numpy as np
-from datetime import datetime as dt
 import make_xlsx as mx
 import toktlogger_json_to_df as tl
 import pandas as pd
 import os.path
+import re
 
 filename = 'activity_log'
 
-i = 1
-while os.path.exists(f"{filename}_{i}.xlsx"):
-    print(i)
-    i += 1
+# Find the next version number from a single listing of the directory
+pattern = re.compile(rf'^{re.escape(filename)}_(\d+)\.xlsx$')
+used = [int(m.group(1)) for entry in os.scandir('.')
+        if (m := pattern.match(entry.name))]
+i = max(used) + 1 if used else 1
 
 path = f"{filename}_{i}.xlsx"
 
 toktlogger = 'toktlogger-bonnevie.hi.no' # My laptop VM toktlogger
 
 print('\nPulling data from toktlogger')
-data = tl.json_to_df(toktlogger)
+data, terms = tl.json_to_df(toktlogger)
 metadata_df = tl.pull_metadata(toktlogger)
 
 print('\nWriting XLSX file')
-terms = list(data.columns)
 field_dict = mx.make_dict_of_fields()
 metadata = True
 conversions = True # Include metadata sheet and conversions sheet
@@ -8,24 +8,43 @@
 @contact:    lukem@unis.no
 '''
 import xlsxwriter
+from xlsxwriter.utility import xl_range_abs
 import pandas as pd
+import numpy as np
 import fields
 from argparse import ArgumentParser, RawDescriptionHelpFormatter, Namespace
 import os
+import weakref
+import zipfile
+from functools import lru_cache
+try:
+    # Faster compression of the xlsx file if python-isal is installed
+    from isal import isal_zlib
+except ImportError:
+    isal_zlib = None
 
 DEBUG = 1
 
 DEFAULT_FONT = 'Calibri'
 DEFAULT_SIZE = 10
 
+# The day Excel counts dates from, on the default 1900 date system
+EXCEL_EPOCH = pd.Timestamp('1899-12-30')
+
+# For holding the formats already added to each workbook
+FORMAT_CACHE = weakref.WeakKeyDictionary()
+
 class Field(object):
     """
     Object for holding the specification of a cell
 
     """
 
-    def __init__(self, name, disp_name, validation={},
-                 cell_format={}, width=20, long_list=False):
+    __slots__ = ('name', 'disp_name', 'validation', 'cell_format', 'width',
+                 'long_list')
+
+    def __init__(self, name, disp_name, validation=None,
+                 cell_format=None, width=20, long_list=False):
         """
         Initialising the object
 
@@ -51,63 +70,14 @@ class Field(object):
         """
         self.name = name  # Name of object
         self.disp_name = disp_name  # Title of column
-        self.cell_format = cell_format  # For holding the formatting of the cell
-        self.validation = validation  # For holding the validation of the cell
+        # For holding the formatting of the cell
+        self.cell_format = cell_format if cell_format is not None else {}
+        # For holding the validation of the cell
+        self.validation = validation if validation is not None else {}
         self.long_list = long_list  # For holding the need for an entry in the
         # variables sheet
         self.width = width
 
-    def set_validation(self, validation):
-        """
-        Set the validation of the cell
-
-        Parameters
-        ----------
-        validation : dict
-            A dictionary using the keywords defined in xlsxwriter
-
-        """
-        self.validation = validation
-
-    def set_cell_format(self, cell_format):
-        """
-        Set the validation of the cell
-
-        Parameters
-        ----------
-        cell_format : dict
-            A dictionary using the keywords defined in xlsxwriter
-
-        """
-        self.cell_format = cell_format
-
-    def set_width(self, width):
-        """
-        Set the cell width
-
-        Parameters
-        ----------
-        width : int
-            Number of units for width
-
-
-        """
-        self.width = width
-
-    def set_long_list(self, long_list):
-        """
-        Set the need for moving the source in the list to a cell range in the
-        variables sheet
-
-        Parameters
-        ----------
-        long_list : Boolean
-            True for enabling the long list.
-
-
-        """
-        self.long_list = long_list
-
 
 class Variable_sheet(object):
     """
@@ -131,6 +101,8 @@ class Variable_sheet(object):
         self.sheet.hide()  # Hide the sheet
         # For holding the current row to add variables on
         self.current_column = 0
+        # For holding the variable and its parameters for each column
+        self.columns = []
 
     def add_row(self, variable, parameter_list):
         """
@@ -151,31 +123,43 @@ class Variable_sheet(object):
         """
 
 #         print(parameter_list)
-        self.sheet.write(0, self.current_column, variable)
+        sorted_params = sorted(parameter_list, key=str.lower)
         name = 'Table_' + variable.replace(' ', '_').capitalize()
 
-        tab = self.sheet.add_table(
-            1, self.current_column,
-            1 + len(parameter_list), self.current_column,
-            {'name': name,
-                'header_row': 0}
-        )
-#         print(tab.properties['name'])
-        #
+        # Tables are not supported in constant_memory mode, so the list is
+        # referred to through a defined name instead
+        self.workbook.define_name(
+            name, '=' + self.name + '!' + xl_range_abs(
+                1, self.current_column,
+                len(sorted_params), self.current_column))
 
-        for ii, par in enumerate(sorted(parameter_list, key=str.lower)):
-            self.sheet.write(1 + ii, self.current_column, par)
-        ref = '=INDIRECT("' + name + '")'
+        # The cells are written in write_rows as the workbook is in
+        # constant_memory mode, where rows must be written in order
+        self.columns.append([variable] + sorted_params)
+        ref = '=' + name
 
         # Increment row such that the next gets a new row
         self.current_column = self.current_column + 1
         return ref
 
+    def write_rows(self):
+        """
+        Writes the added variables to the sheet, one row at a time
+
+        """
+        for row in range(max((len(col) for col in self.columns), default=0)):
+            for col, parameters in enumerate(self.columns):
+                if row < len(parameters):
+                    self.sheet.write_string(row, col, parameters[row])
 
+
+@lru_cache(maxsize=None)
 def make_dict_of_fields():
     """
     Makes a dictionary of the possible fields.
     Does this by reading the fields list from the fields.py library
+    The dictionary is only made on the first call, later calls return the
+    same dictionary, so it should not be modified
 
     Returns
     ---------
@@ -186,25 +170,137 @@ def make_dict_of_fields():
 
     """
 
-    field_dict = {}
-    for field in fields.fields:
-        field['name'] = field['name']
-        new = Field(field['name'], field['disp_name'])
-        if 'valid' in field:
-            new.set_validation(field['valid'])
-#             print(new.validation)
-        if 'cell_format' in field:
-            new.set_cell_format(field['cell_format'])
-        if 'width' in field:
-            new.set_width(field['width'])
-        else:
-            new.set_width(len(field['disp_name']))
-        if 'long_list' in field:
-            new.set_long_list(field['long_list'])
-
-        field_dict[field['name']] = new
+    field_dict = {
+        field['name']: Field(field['name'], field['disp_name'],
+                             validation=normalise_validation(
+                                 field.get('valid', {})),
+                             cell_format=field.get('cell_format', {}),
+                             width=field.get('width', len(field['disp_name'])),
+                             long_list=field.get('long_list', False))
+        for field in fields.fields
+    }
     return field_dict
 
+
+def normalise_validation(validation):
+    """
+    Makes a copy of the validation that is within the limits of Excel
+
+    Parameters
+    ----------
+    validation : dict
+        A dictionary using the keywords defined in xlsxwriter
+
+    Returns
+    ----------
+    validation : dict
+        The copy, with 'input_message' no more than 255 and 'input_title'
+        no more than 32 characters long
+    """
+
+    validation = dict(validation)
+    if len(validation.get('input_message', '')) > 255:
+        validation['input_message'] = validation['input_message'][:252] + '...'
+    if len(validation.get('input_title', '')) > 32:
+        validation['input_title'] = validation['input_title'][:32]
+    return validation
+
+
+def get_format(workbook, properties):
+    """
+    Gets the format with the given properties, only adding it to the workbook
+    the first time it is asked for
+
+    Parameters
+    ----------
+    workbook : xlsxwriter Workbook
+        The workbook the format is used in
+
+    properties : dict
+        A dictionary using the keywords defined in xlsxwriter
+
+    Returns
+    ----------
+    cell_format : xlsxwriter Format
+        The format with the given properties
+    """
+
+    formats = FORMAT_CACHE.setdefault(workbook, {})
+    key = frozenset(properties.items())
+    if key not in formats:
+        formats[key] = workbook.add_format(properties)
+    return formats[key]
+
+
+def get_writer(sheet, column):
+    """
+    Finds the worksheet method for writing the values of a column, based on
+    the type of the values in it
+
+    Parameters
+    ----------
+    sheet : xlsxwriter Worksheet
+        The sheet the column is written to
+
+    column : pandas.core.series.Series
+        The values of the column, with missing values as NaN
+
+    Returns
+    ----------
+    write : method
+        The write method of the sheet to use for the values
+    """
+
+    kind = pd.api.types.infer_dtype(column, skipna=True)
+    if kind == 'string':
+        return sheet.write_string
+    elif kind in ['integer', 'floating', 'mixed-integer-float', 'decimal']:
+        return sheet.write_number
+    elif kind == 'boolean':
+        return sheet.write_boolean
+    elif kind in ['datetime64', 'datetime', 'date', 'time', 'timedelta']:
+        return sheet.write_datetime
+    else:
+        # Mixed columns are left to xlsxwriter to decide for each value
+        return sheet.write
+
+
+def excel_serials(column, time_only=False):
+    """
+    Converts a column of dates or times to the numbers Excel stores them as,
+    so they can be written with write_number
+
+    Parameters
+    ----------
+    column : pandas.core.series.Series
+        The values of the column, with missing values as NaN
+
+    time_only : Boolean, optional
+        True for only keeping the time of day
+
+    Returns
+    ----------
+    column : pandas.core.series.Series
+        Days since 1899-12-30, or the fraction of the day if time_only.
+        Columns not holding dates or times are returned unchanged
+    """
+
+    kind = pd.api.types.infer_dtype(column, skipna=True)
+    day = pd.Timedelta(days=1)
+    if kind in ['datetime64', 'datetime', 'date'] and not time_only:
+        return (pd.to_datetime(column) - EXCEL_EPOCH) / day
+    elif kind in ['datetime64', 'datetime'] and time_only:
+        column = pd.to_datetime(column)
+        return (column - column.dt.normalize()) / day
+    elif kind == 'time' and time_only:
+        # Times of day are read as the time since midnight
+        return pd.to_timedelta(column.astype(str).where(column.notna())) / day
+    elif kind == 'timedelta':
+        return pd.to_timedelta(column) / day
+    else:
+        return column
+
+
 def write_conversion(args, workbook):
     """
     Adds a conversion sheet to workbook
@@ -222,7 +318,7 @@ def write_conversion(args, workbook):
 
     sheet = workbook.add_worksheet('Conversion')
 
-    parameter_format = workbook.add_format({
+    parameter_format = get_format(workbook, {
         'font_name': DEFAULT_FONT,
         'right': True,
         'bottom': True,
@@ -232,7 +328,7 @@ def write_conversion(args, workbook):
         'font_size': DEFAULT_SIZE + 2,
         'bg_color': '#B9F6F5',
     })
-    center_format = workbook.add_format({
+    center_format = get_format(workbook, {
         'font_name': DEFAULT_FONT,
         'right': True,
         'bottom': True,
@@ -242,7 +338,7 @@ def write_conversion(args, workbook):
         'font_size': DEFAULT_SIZE + 2,
         'bg_color': '#23EEFF',
     })
-    output_format = workbook.add_format({
+    output_format = get_format(workbook, {
         'font_name': DEFAULT_FONT,
         'right': True,
         'bottom': True,
@@ -253,7 +349,7 @@ def write_conversion(args, workbook):
         'bg_color': '#FF94E8',
     })
 
-    input_format = workbook.add_format({
+    input_format = get_format(workbook, {
         'bold': False,
         'font_name': DEFAULT_FONT,
         'text_wrap': True,
@@ -304,7 +400,7 @@ def write_metadata(args, workbook, field_dict, metadata_df):
     metadata_fields = ['title', 'abstract', 'pi_name', 'pi_email', 'pi_institution',
                        'pi_address', 'recordedBy', 'projectID', 'cruiseNumber', 'vesselName']
 
-    parameter_format = workbook.add_format({
+    parameter_format = get_format(workbook, {
         'font_name': DEFAULT_FONT,
         'right': True,
         'bottom': True,
@@ -314,7 +410,7 @@ def write_metadata(args, workbook, field_dict, metadata_df):
         'font_size': DEFAULT_SIZE + 2,
         'bg_color': '#B9F6F5',
     })
-    input_format = workbook.add_format({
+    input_format = get_format(workbook, {
         'bold': False,
         'font_name': DEFAULT_FONT,
         'text_wrap': True,
@@ -324,36 +420,31 @@ def write_metadata(args, workbook, field_dict, metadata_df):
 
 
     sheet.set_column(0, 0, width=30)
+    sheet.set_column(1, 1, None, None, {'hidden': True})
     sheet.set_column(2, 2, width=50)
+
+    # Look up all the metadata values at once, empty if not given
+    if isinstance(metadata_df, pd.DataFrame) and len(metadata_df) > 0:
+        values = metadata_df.reindex(columns=metadata_fields).iloc[0]
+        values = values.astype(object).where(values.notna(), '').tolist()
+    else:
+        values = [''] * len(metadata_fields)
+
     for ii, mfield in enumerate(metadata_fields):
         field = field_dict[mfield]
-        sheet.write(ii, 0, field.disp_name, parameter_format)
-        sheet.write(ii, 1, field.name, parameter_format)
-        sheet.set_column(1, 1, None, None, {'hidden': True})
-
-        if type(metadata_df) == pd.core.frame.DataFrame:
-            try:
-                sheet.write(ii,2,metadata_df[mfield][0], input_format)
-            except:
-                sheet.write(ii, 2, '', input_format)
-                continue
-        else:
-            sheet.write(ii, 2, '', input_format)
+        sheet.write_row(ii, 0, [field.disp_name, field.name], parameter_format)
+        sheet.write(ii, 2, values[ii], input_format)
 
         if field.validation:
             if args.verbose > 0:
                 print("Writing metadata validation")
-            valid_copy = field.validation.copy()
-            if len(valid_copy['input_message']) > 255:
-                valid_copy['input_message'] = valid_copy[
-                    'input_message'][:252] + '...'
             sheet.data_validation(first_row=ii,
                                   first_col=2,
                                   last_row=ii,
                                   last_col=2,
-                                  options=valid_copy)
+                                  options=field.validation)
             if field.cell_format:
-                cell_format = workbook.add_format(field.cell_format)
+                cell_format = get_format(workbook, field.cell_format)
                 sheet.set_row(
                     ii, ii, cell_format=cell_format)
 
@@ -366,15 +457,18 @@ def write_metadata(args, workbook, field_dict, metadata_df):
 
         sheet.set_row(ii, height)
 
-def make_xlsx(args, file_def, field_dict, metadata, conversions, data, metadata_df):
+def write_data(args, workbook, file_def, field_dict, data):
     """
-    Writes the xlsx file based on the wanted fields
+    Adds a data sheet to workbook, and the variables sheet for any long lists
 
     Parameters
     ----------
     args : argparse object
         The input arguments
 
+    workbook : xlsxwriter Workbook
+        The workbook for the data sheet
+
     file_def : dict
         The definition of the file wanted, generate this with read_xml
 
@@ -382,34 +476,21 @@ def make_xlsx(args, file_def, field_dict, metadata, conversions, data, metadata_
         Contains a dictionary of Field objects and their name, made with
         make_dict_of _fields()
 
-    metadata: Boolean
-        Should the metadata sheet be written
-
-    conversions: Boolean
-        Should the conversions sheet be written
-
     data: pandas.core.frame.DataFrame
         Optional parameter. Option to add data from a dataframe to the 'data' sheet.
 
-    metadata_df: pandas.core.frame.DataFrame
-        Optional parameter. Option to add metadata from a dataframe to the 'metadata' sheet.
-
     """
 
-    output = os.path.join(args.dir, file_def['name'] + '.xlsx')
-    workbook = xlsxwriter.Workbook(output)
-
-    # Set font
-    workbook.formats[0].set_font_name(DEFAULT_FONT)
-    workbook.formats[0].set_font_size(DEFAULT_SIZE)
-
-    if metadata:
-        write_metadata(args, workbook, field_dict, metadata_df)
     # Create sheet for data
     data_sheet = workbook.add_worksheet('Data')
-    variable_sheet_obj = Variable_sheet(workbook)
-
-    header_format = workbook.add_format({
+    # Only add the sheet for long lists if any of the fields need it
+    if any(field_dict[name].long_list and field_dict[name].validation
+           for name in file_def['fields']):
+        variable_sheet_obj = Variable_sheet(workbook)
+    else:
+        variable_sheet_obj = None
+
+    header_format = get_format(workbook, {
         #         'bg_color': '#C6EFCE',
         'font_color': '#FF0000',
         'font_name': DEFAULT_FONT,
@@ -420,7 +501,7 @@ def make_xlsx(args, file_def, field_dict, metadata, conversions, data, metadata_
         'font_size': DEFAULT_SIZE + 2
     })
 
-    field_format = workbook.add_format({
+    field_format = get_format(workbook, {
         'font_name': DEFAULT_FONT,
         'bottom': True,
         'right': True,
@@ -431,7 +512,7 @@ def make_xlsx(args, file_def, field_dict, metadata, conversions, data, metadata_
         'bg_color': '#B9F6F5'
     })
 
-    date_format = workbook.add_format({
+    date_format = get_format(workbook, {
         'font_name': DEFAULT_FONT,
         'bold': False,
         'text_wrap': False,
@@ -440,7 +521,7 @@ def make_xlsx(args, file_def, field_dict, metadata, conversions, data, metadata_
         'num_format': 'dd/mm/yy'
         })
 
-    time_format = workbook.add_format({
+    time_format = get_format(workbook, {
         'font_name': DEFAULT_FONT,
         'bold': False,
         'text_wrap': False,
@@ -454,99 +535,204 @@ def make_xlsx(args, file_def, field_dict, metadata, conversions, data, metadata_
     parameter_row = title_row + 1  # Parameter row, hidden
     end_row = 20000  # ending row
 
+    # Add header first, as rows can not be written to after the next is started
+    data_sheet.write(0, 0, file_def['disp_name'], header_format)
+    # Add hint about pasting
+    data_sheet.merge_range(0, 1, 0, 7,
+                           "When pasting only use 'paste special' / 'paste only', selecting numbers and/or text ",
+                           header_format)
+    # Set height of row
+    data_sheet.set_row(0, height=24)
+
+    # Write title row
+    data_sheet.write_row(title_row, 0,
+                         [field_dict[name].disp_name for name in file_def['fields']],
+                         field_format)
+    # Write row below with parameter names
+    data_sheet.write_row(parameter_row, 0,
+                         [field_dict[name].name for name in file_def['fields']])
+    # Hide ID row
+    data_sheet.set_row(parameter_row, None, None, {'hidden': True})
+
+    # For holding the first and last column of each validation range
+    validations = []
+    # For holding the first and last column of each width and format range
+    column_settings = []
+
     # Loop over all the variables needed
     for ii in range(len(file_def['fields'])):
         # Get the wanted field object
         field = field_dict[file_def['fields'][ii]]
 
-        # Write title row
-        data_sheet.write(title_row, ii, field.disp_name, field_format)
-
-        # Write row below with parameter name
-        data_sheet.write(parameter_row, ii, field.name)
         # Write validation
-        if field.validation is not None:
+        if field.validation:
             if args.verbose > 0:
                 print("Writing validation for", file_def['fields'][ii])
 
             if field.long_list:
-                # We need to add the data to the validation sheet
-                # Copying the dict as we need to modify it
-                valid_copy = field.validation.copy()
-
-                # Add the validation variable to the hidden sheet
+                # We need to add the data to the validation sheet, and
+                # refer to it instead of the source
                 ref = variable_sheet_obj.add_row(
-                    field.name, valid_copy['source'])
-                valid_copy.pop('source', None)
-                valid_copy['value'] = ref
-                valid_copy['input_message'].replace('\n', '\n\r')
-                data_sheet.data_validation(first_row=start_row,
-                                           first_col=ii,
-                                           last_row=end_row,
-                                           last_col=ii,
-                                           options=valid_copy)
+                    field.name, field.validation['source'])
+                valid = {key: value for key, value in field.validation.items()
+                         if key != 'source'}
+                valid['value'] = ref
             else:
-                # Need to make sure that 'input_message' is not more than 255
-                valid_copy = field.validation.copy()
-                if len(valid_copy['input_message']) > 255:
-                    valid_copy['input_message'] = valid_copy[
-                        'input_message'][:252] + '...'
-                valid_copy['input_message'].replace('\n', '\n\r')
-                # Need to make sure that 'input_title' is not more than 32
-                # characters long
-                if len(valid_copy['input_title']) > 32:
-                    valid_copy['input_title'] = valid_copy[
-                        'input_title'][:32]
-
-                data_sheet.data_validation(first_row=start_row,
-                                           first_col=ii,
-                                           last_row=end_row,
-                                           last_col=ii,
-                                           options=valid_copy)
+                valid = field.validation
+
+            # Extend the previous range if the validation is the same
+            if (validations and validations[-1][1] == ii - 1
+                    and validations[-1][2] == valid):
+                validations[-1][1] = ii
+            else:
+                validations.append([ii, ii, valid])
         if field.cell_format is not None:
-            if not('font_name' in field.cell_format):
-                field.cell_format['font_name'] = DEFAULT_FONT
-            if not('font_size' in field.cell_format):
-                field.cell_format['font_size'] = DEFAULT_SIZE
-            cell_format = workbook.add_format(field.cell_format)
-            data_sheet.set_column(
-                ii, ii, width=field.width, cell_format=cell_format)
+            cell_format = dict(field.cell_format)
+            if not('font_name' in cell_format):
+                cell_format['font_name'] = DEFAULT_FONT
+            if not('font_size' in cell_format):
+                cell_format['font_size'] = DEFAULT_SIZE
+            cell_format = get_format(workbook, cell_format)
         else:
-            data_sheet.set_column(first_col=ii, last_col=ii, width=field.width)
-
-
-    # Write optional data to data sheet
-    if type(data) == pd.core.frame.DataFrame:
-        for col_num, field in enumerate(data):
-            try:
-                if field in ['eventDate', 'start_date', 'end_date']:
-                    data_sheet.write_column(start_row,col_num,list(data[field]), date_format)
-                elif field in ['eventTime', 'start_time', 'end_time']:
-                    data_sheet.write_column(start_row,col_num,list(data[field]), time_format)
-                else:
-                    data_sheet.write_column(start_row,col_num,list(data[field]))
-            except:
-                pass
-
-    # Add header, done after the other to get correct format
-    data_sheet.write(0, 0, file_def['disp_name'], header_format)
-    # Add hint about pasting
-    data_sheet.merge_range(0, 1, 0, 7,
-                           "When pasting only use 'paste special' / 'paste only', selecting numbers and/or text ",
-                           header_format)
-    # Set height of row
-    data_sheet.set_row(0, height=24)
+            cell_format = None
+
+        # Extend the previous range if the width and format are the same.
+        # Formats are cached, so the same format is the same object
+        if (column_settings and column_settings[-1][1] == ii - 1
+                and column_settings[-1][2] == field.width
+                and column_settings[-1][3] is cell_format):
+            column_settings[-1][1] = ii
+        else:
+            column_settings.append([ii, ii, field.width, cell_format])
+
+    # Set width and format, once for each range of columns
+    for first_col, last_col, width, cell_format in column_settings:
+        data_sheet.set_column(first_col, last_col, width=width,
+                              cell_format=cell_format)
+
+    # Write validation, once for each range of columns
+    for first_col, last_col, valid in validations:
+        data_sheet.data_validation(first_row=start_row,
+                                   first_col=first_col,
+                                   last_row=end_row,
+                                   last_col=last_col,
+                                   options=valid)
 
     # Freeze the rows at the top
     data_sheet.freeze_panes(start_row, 0)
 
-    # Hide ID row
-    data_sheet.set_row(parameter_row, None, None, {'hidden': True})
+    # Write optional data to data sheet, row by row
+    if isinstance(data, pd.DataFrame) and not data.empty:
+        # Decide once per column how the values are written
+        columns = []
+        col_writers = []
+        col_formats = []
+        for field in data:
+            column = data[field]
+            if (pd.api.types.is_object_dtype(column)
+                    or pd.api.types.is_string_dtype(column)):
+                # Empty strings are written as empty cells
+                column = column.mask(column == '')
+            if field in ['eventDate', 'start_date', 'end_date']:
+                column = excel_serials(column)
+                col_formats.append(date_format)
+            elif field in ['eventTime', 'start_time', 'end_time']:
+                column = excel_serials(column, time_only=True)
+                col_formats.append(time_format)
+            else:
+                col_formats.append(None)
+            columns.append(column.astype(object).where(column.notna(), None))
+            col_writers.append(get_writer(data_sheet, column))
+
+        # Walk the values in row order, as native Python objects
+        values = np.column_stack([column.to_numpy() for column in columns])
+        col_specs = list(zip(col_writers, col_formats))
+        for row_num, row in enumerate(values.tolist()):
+            for col_num, (value, (write, cell_format)) in enumerate(
+                    zip(row, col_specs)):
+                if value is not None:
+                    write(start_row + row_num, col_num, value, cell_format)
+
+    if variable_sheet_obj is not None:
+        variable_sheet_obj.write_rows()
+
+
+def make_xlsx(args, file_def, field_dict, metadata, conversions, data, metadata_df):
+    """
+    Writes the xlsx file based on the wanted fields
+
+    Parameters
+    ----------
+    args : argparse object
+        The input arguments
+
+    file_def : dict
+        The definition of the file wanted, generate this with read_xml
+
+    field_dict : dict
+        Contains a dictionary of Field objects and their name, made with
+        make_dict_of _fields()
+
+    metadata: Boolean
+        Should the metadata sheet be written
+
+    conversions: Boolean
+        Should the conversions sheet be written
+
+    data: pandas.core.frame.DataFrame
+        Optional parameter. Option to add data from a dataframe to the 'data' sheet.
+
+    metadata_df: pandas.core.frame.DataFrame
+        Optional parameter. Option to add metadata from a dataframe to the 'metadata' sheet.
+
+    """
+
+    output = os.path.join(args.dir, file_def['name'] + '.xlsx')
+    # constant_memory flushes each row as soon as the next one is started,
+    # so every sheet has to be written strictly from top to bottom
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True,
+                                            'strings_to_urls': False,
+                                            'default_date_format': 'dd/mm/yy'})
+
+    # Set font
+    workbook.formats[0].set_font_name(DEFAULT_FONT)
+    workbook.formats[0].set_font_size(DEFAULT_SIZE)
+
+    if metadata:
+        write_metadata(args, workbook, field_dict, metadata_df)
+
+    write_data(args, workbook, file_def, field_dict, data)
 
     if conversions:
         write_conversion(args, workbook)
 
-    workbook.close()
+    close_workbook(workbook)
+
+
+def close_workbook(workbook):
+    """
+    Closes the workbook, which writes and compresses the file.
+    The compression is done with isal when it is installed
+
+    Parameters
+    ----------
+    workbook : xlsxwriter Workbook
+        The workbook to close
+
+    """
+
+    if isal_zlib is None:
+        workbook.close()
+        return
+
+    # xlsxwriter compresses the file with zipfile, which looks up its
+    # compressor in the zlib module when writing each part
+    zlib = zipfile.zlib
+    zipfile.zlib = isal_zlib
+    try:
+        workbook.close()
+    finally:
+        zipfile.zlib = zlib
 
 
 def write_file(url, fields, field_dict, metadata=True, conversions=True, data=False, metadata_df=False):
@@ -11,6 +11,11 @@ import datetime
 from datetime import datetime as dt
 import numpy as np
 import requests
+try:
+    # Faster parsing of the responses if orjson is installed
+    import orjson as json
+except ImportError:
+    import json
 
 def flattenjson( b, delim ):
     '''
@@ -55,13 +60,14 @@ def json_to_df(toktlogger):
     '''
     Provide IP or DNS of toktlogger to access IMR API
 
-    Returns single dataframe that can be included in the gear log
+    Returns single dataframe that can be included in the gear log,
+    and the list of its column names
     '''
 
     #Pull data from IMR API in json format. URL should match IMR API host.
     url = "http://"+toktlogger+"/api/activities/inCurrentCruise?format=json"
     response = requests.get(url)
-    json_activities = response.json()
+    json_activities = json.loads(response.content)
 
     json_activities = list(map( lambda x: flattenjson( x, "__" ), json_activities ))
 
@@ -94,7 +100,8 @@ def json_to_df(toktlogger):
 
     gear_df = pd.read_csv('list_gear_types.csv')
 
-    data = pd.DataFrame(columns=key_map.keys())
+    # For holding one record for each activity, in the order of key_map
+    records = []
 
     for idx, activity in enumerate(json_activities):
 
@@ -107,15 +114,15 @@ def json_to_df(toktlogger):
             for key, val in key_map.items():
 
                 if key in ['eventDate', 'end_date', 'start_date']:
-                    dic[key] = [dt.strptime(activity[val], '%Y-%m-%dT%H:%M:%S.%fZ').date()]
+                    dic[key] = dt.strptime(activity[val], '%Y-%m-%dT%H:%M:%S.%fZ').date()
                 elif key in ['eventTime', 'end_time', 'start_time']:
-                    dic[key] = [dt.strptime(activity[val], '%Y-%m-%dT%H:%M:%S.%fZ').time()]
+                    dic[key] = dt.strptime(activity[val], '%Y-%m-%dT%H:%M:%S.%fZ').time()
 
                 elif key in ['decimalLatitude','endDecimalLatitude']:
-                    dic[key] = [activity[val][1]]
+                    dic[key] = activity[val][1]
 
                 elif key in ['decimalLongitude','endDecimalLongitude']:
-                    dic[key] = [activity[val][0]]
+                    dic[key] = activity[val][0]
 
                 elif key in ['bottomDepthInMeters']:
 
@@ -135,50 +142,51 @@ def json_to_df(toktlogger):
                     etss = end_dt.strftime('%S.%f')[:-3]
                     url = "http://"+toktlogger+"/api/instrumentData/inPeriod?after="+start_date+"T"+sthh+"%3A"+stmm+"%3A"+stss+"Z&before="+end_date+"T"+ethh+"%3A"+etmm+"%3A"+etss+"Z&mappingIds=depth&format=json"
                     response = requests.get(url)
-                    json_bd = response.json()
+                    json_bd = json.loads(response.content)
 
                     if len(json_bd) >= 1:
                         bd = []
                         for i, t in enumerate(json_bd):
                             bd.append(t['numericValue'])
-                        dic[key] = [np.median([bd])]
+                        dic[key] = np.median([bd])
                     else:
-                        dic[key] = ['']
+                        dic[key] = ''
 
                 elif key == 'stationName':
                     numFields = len(activity['fields'])
                     for fld in range(numFields):
                         if "station" in activity['fields'][fld]['name'].lower():
-                            dic[key] = [activity['fields'][fld]['value']]
+                            dic[key] = activity['fields'][fld]['value']
                         else:
-                            dic[key] = ['']
+                            dic[key] = ''
                     if numFields == 0:
-                        dic[key] = ['']
+                        dic[key] = ''
 
                 # Getting gear type from IMR activities list if possible by using the mapping in the list_gear_types.csv file
                 elif key == 'gearType':
                     if activity['activityTypeName'] in gear_df['IMR name'].values:
-                        dic[key] = [gear_df.loc[gear_df['IMR name'] == activity['activityTypeName'], 'Gear type'].item()]
+                        dic[key] = gear_df.loc[gear_df['IMR name'] == activity['activityTypeName'], 'Gear type'].item()
                     else:
-                        dic[key] = ['']
+                        dic[key] = ''
 
                 elif val == '':
-                    dic[key] = ['']
+                    dic[key] = ''
 
                 else:
-                    dic[key] = [activity[val]]
+                    dic[key] = activity[val]
 
-            new_activity = pd.DataFrame.from_dict(dic)
-            print(new_activity)
-            data = pd.concat([data, new_activity], ignore_index=True)
+            records.append(dic)
 
-    return data
+    terms = list(key_map.keys())
+    data = pd.DataFrame.from_records(records, columns=terms)
+
+    return data, terms
 
 def pull_metadata(toktlogger):
 
     url = "http://"+toktlogger+"/api/cruises/current?format=json"
     response = requests.get(url)
-    json_cruise = response.json()
+    json_cruise = json.loads(response.content)
 
     metadata_dic = {
         'title': [''],